@@ -1,18 +1,76 @@
 import subprocess
 import sys
 import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from batch_store import export_batch_xlsx
+import expiry_decision_03
+import email_sending_04
 
 BASE_DIR = r"C:\Coding\ACOS"
 
-scripts = [
-    "vendor_matcher_02.py",
-    "expiry_decision_03.py",
-    "email_sending_04.py"
-]
+# script -> scripts that must finish successfully before it starts
+scripts = {
+    "vendor_matcher_02.py": [],
+    "expiry_decision_03.py": ["vendor_matcher_02.py"],   # needs vendor mapping
+    "email_sending_04.py": ["expiry_decision_03.py"],    # needs expiry_actions.json
+}
+
+# Scripts run in this process instead of a subprocess, so they share
+# batch_store's parsed copy of batch details
+in_process = {
+    "expiry_decision_03.py": expiry_decision_03.main,
+    "email_sending_04.py": email_sending_04.send_vendor_emails,
+}
+
+
+def run_script(script):
+    if script in in_process:
+        try:
+            in_process[script]()
+            return 0
+        except Exception:
+            traceback.print_exc()
+            return 1
 
-for script in scripts:
     script_path = os.path.join(BASE_DIR, script)
-    result = subprocess.run([sys.executable, script_path])
-    if result.returncode != 0:
-        print(f"Error running {script}")
-        break
+    return subprocess.run([sys.executable, script_path]).returncode
+
+
+def run_pipeline(scripts):
+    """
+    Start every script as soon as its dependencies have finished, so
+    independent scripts run side by side. Stops scheduling on the first failure.
+    """
+    done = set()
+    running = {}
+
+    with ThreadPoolExecutor() as executor:
+        while True:
+            for script, deps in scripts.items():
+                if (
+                    script not in done
+                    and script not in running.values()
+                    and all(dep in done for dep in deps)
+                ):
+                    running[executor.submit(run_script, script)] = script
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                script = running.pop(future)
+                if future.result() != 0:
+                    print(f"Error running {script}")
+                    return False
+                done.add(script)
+
+    return len(done) == len(scripts)
+
+
+if __name__ == "__main__":
+    if run_pipeline(scripts):
+        # Human-readable copy of the batch table, written once per pipeline run
+        export_batch_xlsx()
@@ -0,0 +1,313 @@
+import sys
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, time
+from pathlib import Path
+from openpyxl import Workbook, load_workbook
+
+# ---------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------
+
+# Parquet is the working copy read and written by every pipeline step.
+# The Excel workbook is a human-readable export. It is refreshed after
+# pipeline runs (batch_runner) and batch runs of expiry_vision_01 and
+# vendor_reply__update_05; single-label watchdog updates appear in it at
+# the next export.
+#
+# Manual edits go in batch_details.xlsx, right after an export, and are
+# then loaded into the working copy with:
+#     python batch_store.py --import-xlsx
+# Exports never overwrite a workbook edited since the last export, and the
+# import refuses if the working copy changed since then, so neither side's
+# changes are silently lost.
+BATCH_PARQUET_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Data\batch_details.parquet"
+BATCH_XLSX_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Data\batch_details.xlsx"
+
+# File mtimes recorded at the last export (or import)
+BATCH_EXPORT_STAMP_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Data\batch_details.export.json"
+
+# Identifier columns are text even when they look numeric (e.g. batch "00123")
+TEXT_COLUMNS = [
+    "batch_number",
+    "part_number",
+    "vendor_canonical_name",
+    "vendor_email",
+]
+
+# Quantity columns: kept numeric even after rows are filled with Python ints/blanks
+NUMERIC_COLUMNS = [
+    "units_in_batch",
+    "quantity_per_unit",
+    "total_quantity",
+]
+
+# ---------------------------------------------------------
+# IN-PROCESS CACHE
+# ---------------------------------------------------------
+
+# Steps running in the same process (see batch_runner) share one parsed copy.
+# Keyed on the Parquet file's mtime so writes from other processes are seen.
+_cache = {"mtime": None, "df": None}
+
+
+def _parquet_mtime():
+    path = Path(BATCH_PARQUET_PATH)
+    return path.stat().st_mtime_ns if path.exists() else None
+
+# ---------------------------------------------------------
+# EXCEL READER
+# ---------------------------------------------------------
+
+# Workbooks already read in this process, keyed on (path, mtime)
+_excel_cache = {}
+
+
+def read_excel_fast(path, text_columns=()) -> pd.DataFrame:
+    """
+    Read the first sheet of a workbook into a DataFrame.
+    Uses openpyxl read-only mode, which streams rows instead of building the
+    whole workbook in memory. Columns in `text_columns` are kept as text.
+    """
+    key = (str(path), Path(path).stat().st_mtime_ns)
+
+    if key not in _excel_cache:
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = [
+                name if name is not None else f"Unnamed: {i}"
+                for i, name in enumerate(next(rows, ()))
+            ]
+            df = pd.DataFrame(list(rows), columns=header)
+        finally:
+            wb.close()
+
+        # Read-only sheets can report trailing rows that hold no values
+        df = df.dropna(how="all").reset_index(drop=True)
+
+        for col in text_columns:
+            if col in df.columns:
+                df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+
+        _excel_cache[key] = df
+
+    return _excel_cache[key].copy()
+
+# ---------------------------------------------------------
+# DATE PARSING
+# ---------------------------------------------------------
+
+def to_dates(values: pd.Series) -> pd.Series:
+    """
+    Parse a date column (YYYY-MM-DD, DD-MM-YYYY, DD-MM-YY or Excel dates) to
+    datetime64. Blank or unparseable cells become NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+
+    # Stored dates are ISO (YYYY-MM-DD, with or without a time part): an explicit
+    # format parses them in one vectorized pass. Only the leftovers (DD-MM-YY(YY))
+    # use the mixed parser, where dayfirst can't swap month and day of ISO dates.
+    dates = pd.to_datetime(values, errors="coerce", format="ISO8601")
+
+    rest = dates.isna() & values.fillna("").astype(str).str.strip().ne("")
+    if rest.any():
+        dates[rest] = pd.to_datetime(
+            values[rest], errors="coerce", format="mixed", dayfirst=True
+        )
+
+    return dates
+
+# ---------------------------------------------------------
+# LOAD / SAVE
+# ---------------------------------------------------------
+
+def load_batch_details(columns=None, share=True) -> pd.DataFrame:
+    """
+    Load batch details from Parquet.
+    Falls back to the Excel workbook until the first Parquet file is written.
+    With `columns`, only those columns are returned (ones not in the file are
+    skipped). Read-only callers use this; anything that saves needs all columns.
+    With share=False and a cold cache, only those columns are read from the
+    file and nothing is cached: for a script running on its own, when no
+    later step in the process will load the full table.
+    """
+    mtime = _parquet_mtime()
+
+    if mtime is None:
+        df = read_excel_fast(BATCH_XLSX_PATH, text_columns=TEXT_COLUMNS)
+        return df if columns is None else df[[c for c in columns if c in df.columns]]
+
+    if _cache["mtime"] != mtime:
+        if columns is not None and not share:
+            available = set(pq.read_schema(BATCH_PARQUET_PATH).names)
+            return pd.read_parquet(
+                BATCH_PARQUET_PATH,
+                engine="pyarrow",
+                columns=[c for c in columns if c in available]
+            )
+
+        # Full read: later steps in the same process (see batch_runner)
+        # slice or copy this one parsed frame instead of reading the file again
+        _cache["df"] = pd.read_parquet(BATCH_PARQUET_PATH, engine="pyarrow")
+        _cache["mtime"] = mtime
+
+    df = _cache["df"]
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+
+    # Callers modify what they load; keep the cached copy untouched
+    return df.copy()
+
+
+def _cell_text(value) -> str:
+    """Text for one cell of a mixed column, in the formats the pipeline reads back."""
+    if isinstance(value, datetime) and value.time() == time(0):
+        return str(value.date())  # Excel date -> YYYY-MM-DD
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))  # 5.0 -> "5"
+    return str(value)
+
+
+def save_batch_details(df: pd.DataFrame, export_xlsx=False):
+    """
+    Write batch details to Parquet.
+    With export_xlsx=True the Excel copy is refreshed as well.
+    """
+    df = df.copy()
+
+    # Blank cells count as missing; a column of numbers stays numeric
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns and df[col].dtype == object:
+            values = df[col].mask(df[col].astype(str).str.strip() == "")
+            try:
+                df[col] = pd.to_numeric(values)
+            except (ValueError, TypeError):
+                pass  # hand-entered text: left to the mixed-column rule below
+
+    # Parquet needs one type per column: only object columns pyarrow can't
+    # type (e.g. text mixed with numbers or Excel dates) are stored as text.
+    # str-dtype columns are already uniform text.
+    for col in [c for c in df.columns if df[c].dtype == object]:
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[col] = df[col].map(_cell_text, na_action="ignore")
+
+    # pyarrow dictionary-encodes string columns by default, which keeps
+    # low-cardinality columns (vendor names, match status) small on disk
+    df.to_parquet(BATCH_PARQUET_PATH, engine="pyarrow", index=False)
+
+    _cache["df"] = df
+    _cache["mtime"] = _parquet_mtime()
+
+    if export_xlsx:
+        export_batch_xlsx(df)
+
+
+# ---------------------------------------------------------
+# EXCEL EXPORT / IMPORT
+# ---------------------------------------------------------
+
+def _mtime(path):
+    path = Path(path)
+    return path.stat().st_mtime_ns if path.exists() else None
+
+
+def _read_export_stamp():
+    try:
+        with open(BATCH_EXPORT_STAMP_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_export_stamp():
+    with open(BATCH_EXPORT_STAMP_PATH, "w", encoding="utf-8") as f:
+        json.dump({"xlsx_mtime": _mtime(BATCH_XLSX_PATH), "parquet_mtime": _parquet_mtime()}, f)
+
+
+def workbook_edited() -> bool:
+    """True if batch_details.xlsx changed since the pipeline last wrote or imported it."""
+    xlsx_mtime = _mtime(BATCH_XLSX_PATH)
+    if xlsx_mtime is None:
+        return False
+
+    stamp = _read_export_stamp()
+    if stamp is None:
+        # Never exported: the workbook is the seed, edited if newer than the working copy
+        parquet_mtime = _parquet_mtime()
+        return parquet_mtime is not None and xlsx_mtime > parquet_mtime
+
+    return xlsx_mtime != stamp["xlsx_mtime"]
+
+
+def export_batch_xlsx(df=None) -> bool:
+    """
+    Refresh batch_details.xlsx (from the Parquet working copy unless df is given).
+    Skipped with a warning if the workbook holds edits that were never imported.
+    """
+    if workbook_edited():
+        print(
+            "WARNING: batch_details.xlsx was edited since the last export and was "
+            "not overwritten. Load the edits with `python batch_store.py --import-xlsx`."
+        )
+        return False
+
+    if df is None:
+        df = load_batch_details()
+    write_excel_fast(df, BATCH_XLSX_PATH)
+    _write_export_stamp()
+    return True
+
+
+def import_batch_xlsx():
+    """
+    Replace the Parquet working copy with batch_details.xlsx (after manual edits).
+    Refuses if the working copy changed since the last export, because those
+    changes are not in the workbook and would be lost.
+    """
+    stamp = _read_export_stamp()
+    if stamp is not None and _parquet_mtime() != stamp["parquet_mtime"]:
+        raise RuntimeError(
+            "batch_details.parquet changed since the last export; its updates are not "
+            "in the workbook. Move the edited workbook aside, export again "
+            "(python batch_runner.py or export_batch_xlsx()) and re-apply the edits there."
+        )
+
+    save_batch_details(read_excel_fast(BATCH_XLSX_PATH, text_columns=TEXT_COLUMNS))
+    _write_export_stamp()
+
+
+def write_excel_fast(df: pd.DataFrame, path):
+    """
+    Write a DataFrame to a single-sheet workbook.
+    Uses openpyxl write-only mode, which streams rows to disk instead of
+    building the whole workbook in memory. Missing values become empty cells.
+    """
+    # Date columns are written as dates (shown as YYYY-MM-DD), not timestamps
+    df = df.copy()
+    for col in df.select_dtypes(include="datetime").columns:
+        df[col] = df[col].dt.date
+
+    # One conversion up front: NaN/NaT -> None, numpy scalars -> Python objects
+    values = df.astype(object).where(df.notna(), None)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="Sheet1")  # same sheet name as DataFrame.to_excel
+    ws.append([str(col) for col in df.columns])
+    for row in values.itertuples(index=False, name=None):
+        ws.append(row)
+    wb.save(path)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--import-xlsx"]:
+        import_batch_xlsx()
+        print("batch_details.xlsx imported into the working copy.")
+    else:
+        print("Usage: python batch_store.py --import-xlsx")
+        sys.exit(2)
@@ -1,14 +1,17 @@
-import json
-import pandas as pd
+import orjson
+import pythoncom
 import win32com.client as win32
 from datetime import datetime
+from batch_store import load_batch_details, save_batch_details
 
 # ---------------------------------------------------------
 # CONFIG
 # ---------------------------------------------------------
 
 ACTIONS_JSON_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Outputs\expiry_actions.json"
-BATCH_XLSX_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Data\batch_details.xlsx"
+
+# False: emails are saved as Outlook drafts for review instead of being sent
+SEND_EMAILS = False
 
 # ---------------------------------------------------------
 # EMAIL BUILDER
@@ -46,13 +49,18 @@ def build_email_body(vendor_name, batches):
 # ---------------------------------------------------------
 
 def send_vendor_emails():
-    with open(ACTIONS_JSON_PATH, "r", encoding="utf-8") as f:
-        payload = json.load(f)
+    with open(ACTIONS_JSON_PATH, "rb") as f:
+        payload = orjson.loads(f.read())
+
+    pythoncom.CoInitialize()
 
-    outlook = win32.Dispatch("Outlook.Application")
-    df = pd.read_excel(BATCH_XLSX_PATH, engine="openpyxl")
+    # Early-bound dispatch: attribute access goes through the generated vtable
+    outlook = win32.gencache.EnsureDispatch("Outlook.Application")
+    df = load_batch_details()
 
     today = datetime.today().strftime("%Y-%m-%d")
+    notified = set()
+    outbox = []
 
     for vendor_data in payload["vendors"].values():
         vendor = vendor_data["vendor_canonical_name"]
@@ -64,19 +72,28 @@ def send_vendor_emails():
         mail.Subject = f"Expiry Revalidation Request | {vendor}"
         mail.Body = build_email_body(vendor, batches)
 
-        # mail.Send()
-        mail.Save()
+        if SEND_EMAILS:
+            outbox.append(mail)
+        else:
+            mail.Save()
+        del mail  # release the COM pointer as soon as the item is composed
 
-        # Update last_notified_date in Excel
-        for batch in batches:
-            df.loc[
-                df["batch_number"] == batch["batch_number"],
-                "last_notified_date"
-            ] = today
+        notified.update(b["batch_number"] for b in batches)
 
         print(f"Email sent to {vendor} ({email})")
 
-    df.to_excel(BATCH_XLSX_PATH, index=False, engine="openpyxl")
+    # Submit all composed emails in one go after composition
+    for mail in outbox:
+        mail.Send()
+    outbox.clear()
+
+    # Update last_notified_date (one pass for all notified batches)
+    df.loc[
+        df["batch_number"].astype(str).str.strip().isin(notified),
+        "last_notified_date"
+    ] = today
+
+    save_batch_details(df)
 
 
 # ---------------------------------------------------------
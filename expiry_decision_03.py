@@ -1,65 +1,73 @@
 import pandas as pd
-import json
-from datetime import datetime
+import numpy as np
+import orjson
+from datetime import datetime, date
 from pathlib import Path
 from collections import Counter
+from dataclasses import dataclass
+from batch_store import load_batch_details, to_dates
 
 # ---------------------------------------------------------
-# CONFIG (DWT – Excel)
+# CONFIG (DWT)
 # ---------------------------------------------------------
 
-BATCH_XLSX_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Data\batch_details.xlsx"
 OUTPUT_JSON_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Outputs\expiry_actions.json"
 
 ALERT_DAYS = 20
 CRITICAL_DAYS = 10
 
+# Evaluated once per run, not once per row
+TODAY = date.today()
+
 # ---------------------------------------------------------
-# DATE UTILITIES
+# BATCH RECORD
 # ---------------------------------------------------------
 
-def parse_date(date_str):
-    """Parse string to date, handle multiple formats."""
-    if not date_str or pd.isna(date_str):
-        return None
-
-    for fmt in ("%Y-%m-%d", "%d-%m-%y", "%d-%m-%Y"):
-        try:
-            return datetime.strptime(str(date_str).strip(), fmt).date()
-        except ValueError:
-            continue
-
-    return None
-
+@dataclass(slots=True)
+class Batch:
+    """One batch in the JSON payload (serialized directly by orjson)."""
+    batch_number: str
+    expiry_date: str
+    revised_expiry_date: str
+    effective_expiry_date: str
+    days_pending: int
+    status: str
+    total_quantity: str
 
-def calculate_status(expiry_date_str, revised_expiry_date_str):
-    """Calculate batch status and days pending."""
-    expiry_date = parse_date(expiry_date_str)
-    revised_expiry_date = parse_date(revised_expiry_date_str)
-    effective_expiry = revised_expiry_date or expiry_date
 
-    if not effective_expiry:
-        return None, None, None
+# Per-batch fields in the JSON payload, in Batch field order
+BATCH_COLUMNS = list(Batch.__dataclass_fields__)
 
-    today = datetime.today().date()
-    days_left = (effective_expiry - today).days
+# ---------------------------------------------------------
+# STATUS ENGINE
+# ---------------------------------------------------------
 
-    if days_left < CRITICAL_DAYS:
-        status = "CRITICAL"
-    elif days_left <= ALERT_DAYS:
-        status = "ALERT"
-    else:
-        status = "NORMAL"
+def calculate_statuses(expiry_dates, revised_expiry_dates, today=TODAY):
+    """Status, days left and effective expiry for whole columns (one vectorized pass)."""
+    effective_expiry = (
+        to_dates(revised_expiry_dates)
+        .fillna(to_dates(expiry_dates))
+        .dt.normalize()
+    )
+    days_left = (effective_expiry - pd.Timestamp(today)).dt.days
+
+    status = pd.Series(
+        np.select(
+            [days_left < CRITICAL_DAYS, days_left <= ALERT_DAYS],
+            ["CRITICAL", "ALERT"],
+            default="NORMAL",
+        ),
+        index=effective_expiry.index,
+    )
+    status[effective_expiry.isna()] = None
 
-    return status, days_left, effective_expiry.strftime("%Y-%m-%d")
+    return status, days_left, effective_expiry
 
 # ---------------------------------------------------------
 # CORE DECISION ENGINE
 # ---------------------------------------------------------
 
-def build_expiry_decisions(xlsx_path=BATCH_XLSX_PATH):
-    df = pd.read_excel(xlsx_path, engine="openpyxl")
-
+def build_expiry_decisions(share=True):
     required_cols = [
         "batch_number",
         "expiry_date",
@@ -70,40 +78,45 @@ def build_expiry_decisions(xlsx_path=BATCH_XLSX_PATH):
         "last_notified_date",
     ]
 
-    for col in required_cols:
-        if col not in df.columns:
-            df[col] = ""
+    df = load_batch_details(columns=required_cols, share=share).reindex(columns=required_cols)
 
-    decisions = []
+    status, days_left, effective_expiry = calculate_statuses(
+        df["expiry_date"],
+        df["revised_expiry_date"]
+    )
+    df["status"] = status
+    df["days_pending"] = days_left
+    df["effective_expiry_date"] = effective_expiry.dt.strftime("%Y-%m-%d")
 
-    for _, row in df.iterrows():
-        status, days_left, effective_expiry = calculate_status(
-            row.get("expiry_date"),
-            row.get("revised_expiry_date")
-        )
+    text_cols = [
+        "vendor_canonical_name",
+        "vendor_email",
+        "batch_number",
+        "expiry_date",
+        "revised_expiry_date",
+        "total_quantity",
+    ]
+    # Expiry columns written by the vendor reply step are datetime64
+    for col in ("expiry_date", "revised_expiry_date"):
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime("%Y-%m-%d")
+    df[text_cols] = df[text_cols].fillna("").astype(str)
 
-        if status not in ("CRITICAL", "ALERT"):
-            continue
+    due = df[df["status"].isin(["CRITICAL", "ALERT"])].copy()
+    due["days_pending"] = due["days_pending"].astype(int)
 
-        vendor = str(row.get("vendor_canonical_name") or "").strip()
-        email = str(row.get("vendor_email") or "").strip()
-        batch_number = str(row.get("batch_number") or "").strip()
+    for col in ("vendor_canonical_name", "vendor_email", "batch_number"):
+        due[col] = due[col].str.strip()
 
-        if not vendor or not email:
-            print(f"Skipping batch '{batch_number}' due to missing vendor mapping or email.")
-            continue
+    unmapped = (due["vendor_canonical_name"] == "") | (due["vendor_email"] == "")
+    for batch_number in due.loc[unmapped, "batch_number"]:
+        print(f"Skipping batch '{batch_number}' due to missing vendor mapping or email.")
 
-        decisions.append({
-            "vendor_canonical_name": vendor,
-            "vendor_email": email,
-            "batch_number": batch_number,
-            "expiry_date": str(row.get("expiry_date") or ""),
-            "revised_expiry_date": str(row.get("revised_expiry_date") or ""),
-            "effective_expiry_date": effective_expiry,
-            "days_pending": days_left,
-            "status": status,
-            "total_quantity": str(row.get("total_quantity") or "")
-        })
+    decisions = due.loc[~unmapped, [
+        "vendor_canonical_name",
+        "vendor_email",
+        *BATCH_COLUMNS,
+    ]]
 
     return decisions
 
@@ -112,30 +125,22 @@ def build_expiry_decisions(xlsx_path=BATCH_XLSX_PATH):
 # ---------------------------------------------------------
 
 def group_by_vendor(decisions):
-    vendor_payload = {}
-
-    for item in decisions:
-        vendor = item["vendor_canonical_name"]
-
-        if vendor not in vendor_payload:
-            vendor_payload[vendor] = {
-                "vendor_canonical_name": vendor,
-                "vendor_email": item["vendor_email"],
-                "batches": []
-            }
+    # One stable sort: vendors keep first-seen order, batches by effective expiry
+    decisions = decisions.assign(
+        vendor_order=pd.factorize(decisions["vendor_canonical_name"])[0]
+    ).sort_values(["vendor_order", "effective_expiry_date"], kind="stable")
 
-        vendor_payload[vendor]["batches"].append({
-            "batch_number": item["batch_number"],
-            "expiry_date": item["expiry_date"],
-            "revised_expiry_date": item["revised_expiry_date"],
-            "effective_expiry_date": item["effective_expiry_date"],
-            "days_pending": item["days_pending"],
-            "status": item["status"],
-            "total_quantity": item["total_quantity"]
-        })
+    vendor_payload = {}
 
-    for data in vendor_payload.values():
-        data["batches"].sort(key=lambda x: x["effective_expiry_date"])
+    for vendor, group in decisions.groupby("vendor_canonical_name", sort=False):
+        vendor_payload[vendor] = {
+            "vendor_canonical_name": vendor,
+            "vendor_email": group["vendor_email"].iat[0],
+            "batches": [
+                Batch(*row)
+                for row in group[BATCH_COLUMNS].itertuples(index=False, name=None)
+            ]
+        }
 
     return vendor_payload
 
@@ -146,24 +151,23 @@ def group_by_vendor(decisions):
 def write_json(payload, output_path=OUTPUT_JSON_PATH):
     Path(output_path).parent.mkdir(parents=True, exist_ok=True)
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(
+    # Compact orjson output: the file is read by email_sending_04, not by people
+    with open(output_path, "wb") as f:
+        f.write(orjson.dumps(
             {
                 "generated_on": datetime.today().strftime("%Y-%m-%d"),
                 "alert_days": ALERT_DAYS,
                 "critical_days": CRITICAL_DAYS,
                 "vendors": payload,
-            },
-            f,
-            indent=2
-        )
+            }
+        ))
 
 # ---------------------------------------------------------
 # MAIN
 # ---------------------------------------------------------
 
-if __name__ == "__main__":
-    decisions = build_expiry_decisions()
+def main(share=True):
+    decisions = build_expiry_decisions(share=share)
     vendor_payload = group_by_vendor(decisions)
     write_json(vendor_payload)
 
@@ -171,6 +175,11 @@ if __name__ == "__main__":
     print(f"Vendors requiring action: {len(vendor_payload)}")
 
     status_counts = Counter(
-        [b["status"] for v in vendor_payload.values() for b in v["batches"]]
+        [b.status for v in vendor_payload.values() for b in v["batches"]]
     )
     print("Status counts:", dict(status_counts))
+
+
+if __name__ == "__main__":
+    # Run on its own: nothing else here needs the full batch table
+    main(share=False)
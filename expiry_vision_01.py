@@ -7,6 +7,11 @@ import sys
 from langchain_google_genai import ChatGoogleGenerativeAI
 # A method to convert images, files into a text-only format.
 import base64
+# Memory-maps image files so they are encoded without an extra in-memory copy.
+import mmap
+# Fast (SIMD) content hash used as the key of the extraction cache.
+from blake3 import blake3
+import threading
 # Helps to interact with the underlying operating system.
 import os
 # To load local environment variables from a .env file.
@@ -15,10 +20,15 @@ import json
 # Messages are objects used in prompts and chat conversations.
 from langchain_core.messages import HumanMessage
 # Pydantic is a data validation and settings management library.
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, ConfigDict, field_validator
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, date
+import re
 import pandas as pd
+import numpy as np
+# Runs Gemini calls concurrently; they are network-bound, not CPU-bound.
+from concurrent.futures import ThreadPoolExecutor
+from batch_store import load_batch_details, save_batch_details, export_batch_xlsx
 
 
 # ---------------------------------------------------------
@@ -26,7 +36,13 @@ import pandas as pd
 # Created a class with attributes to store extracted data. They are Model Fields.
 # ---------------------------------------------------------
 
+# Expiry dates already in the target format skip the strptime round-trip.
+ISO_DATE_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
+
+
 class LabelExtractionResult(BaseModel):
+    model_config = ConfigDict(validate_assignment=False, extra="ignore")
+
     part_number: Optional[str] # Extract where possible on the label.
     product_description: str # str is a type annotation, not an assignment. This attribute exists and the type should be a string.
     vendor_or_brand: str
@@ -43,10 +59,22 @@ class LabelExtractionResult(BaseModel):
     # ----- VALIDATORS -----
 
 
-    @field_validator("expiry_date") # decorator. tells pydantic to use this whenever Expiry_Date field is set.
+    @field_validator("expiry_date", mode="before") # decorator. tells pydantic to use this whenever Expiry_Date field is set.
     def validate_expiry_format(cls, v): # cls: Class LabelExtractionResult; v: Incoming value for Expiry_Date
         if not v:
             return ""
+        if not isinstance(v, str):
+            return v  # left to pydantic's str validation
+
+        # Fast path: already YYYY-MM-DD, only check it is a real date
+        match = ISO_DATE_RE.match(v)
+        if match:
+            try:
+                date(*map(int, match.groups()))
+                return v
+            except ValueError:
+                return ""
+
         try:
             dt = datetime.strptime(v.replace("/", "-"), "%Y-%m-%d")
             return dt.strftime("%Y-%m-%d")
@@ -86,11 +114,47 @@ client = ChatGoogleGenerativeAI(
     temperature=0, # deterministic output. Same input -> same output
 )
 
+# Structured-output wrapper is built once: it translates the Pydantic model into a schema.
+structured_client = client.with_structured_output(LabelExtractionResult)
+
+# Max concurrent Gemini requests when several images are processed in one run
+MAX_WORKERS = 8
+
 
 # ---------------------------------------------------------
 # 3. IMAGE UTILITY FUNCTIONS
 # ---------------------------------------------------------
 
+# Extraction results keyed by the image's content hash: re-dropped or retried
+# labels are answered from here instead of a new Gemini call.
+LABEL_CACHE_PATH = r"C:\Coding\ACOS\label_cache.json"
+
+label_cache_lock = threading.Lock()
+
+
+def load_label_cache():
+    """Cached results, or an empty cache if the file is missing or unreadable."""
+    try:
+        with open(LABEL_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+label_cache = load_label_cache()
+
+
+def save_to_label_cache(image_hash, result):
+    with label_cache_lock:
+        label_cache[image_hash] = result
+        # Write a temp file and swap it in, so a crash mid-write never
+        # leaves a truncated cache behind
+        tmp_path = LABEL_CACHE_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(label_cache, f)
+        os.replace(tmp_path, LABEL_CACHE_PATH)
+
+
 def get_mime_type(ext):
     ext = ext.lower()
     if ext in [".jpg", ".jpeg"]:
@@ -108,10 +172,18 @@ def process_image_with_gemini(image_path):
     """Process image using Gemini Pro Vision LLM — returns Pydantic validated output."""
 
 
-    # Image → Base64
+    # Image → content hash (cache lookup) → Base64
     try:
-        with open(image_path, "rb") as img_file:
-            b64 = base64.b64encode(img_file.read()).decode("utf-8")
+        with open(image_path, "rb") as img_file, \
+                mmap.mmap(img_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            image_hash = blake3(mapped).hexdigest()
+
+            cached = label_cache.get(image_hash)
+            if cached:
+                print(f"Using cached extraction for {os.path.basename(image_path)}")
+                return dict(cached)
+
+            b64 = base64.b64encode(mapped).decode("utf-8")
     except Exception as e:
         return {"error": f"Could not read image: {str(e)}"}
 
@@ -156,19 +228,19 @@ def process_image_with_gemini(image_path):
 
 
     try:
-        structured_client = client.with_structured_output(LabelExtractionResult)
-        result = structured_client.invoke([msg])
-        return result.model_dump()
+        result = structured_client.invoke([msg]).model_dump()
 
     except Exception as e:
         return {"error": f"LLM processing failed: {str(e)}"}
 
+    save_to_label_cache(image_hash, result)
+    return result
+
 # ---------------------------------------------------------
 # 5. CSV UPDATER
 # ---------------------------------------------------------
 
 # CSV_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\ACOS - A Consumable Ordering System\batch_details.csv"
-EXCEL_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Data\batch_details.xlsx" 
 
 # def update_csv_with_extraction(result: dict, csv_path: str = CSV_PATH):
 #     """
@@ -285,17 +357,15 @@ EXCEL_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.co
 #     df.to_csv(csv_path, index=False)
 #     print(f"CSV updated for batch: {extracted['batch_number']}")
 
-def update_excel_with_extraction(result: dict, excel_path: str = EXCEL_PATH):
+def extract_batch_update(result: dict):
     """
-    Updates batch_details.xlsx using Gemini output.
-    - Matches rows using batch_number
-    - Updates only empty cells
-    - Never deletes or overwrites existing data
+    Converts Gemini output into a batch details update (no file I/O).
+    Returns None if the result can't be used.
     """
 
     if "error" in result:
-        print("Skipping Excel update due to extraction error.")
-        return
+        print("Skipping batch details update due to extraction error.")
+        return None
 
     extracted = {
         "batch_number": result.get("batch_number", "").strip(),
@@ -309,15 +379,35 @@ def update_excel_with_extraction(result: dict, excel_path: str = EXCEL_PATH):
     }
 
     if not extracted["batch_number"]:
-        print("Batch number missing. Skipping Excel update.")
-        return
+        print("Batch number missing. Skipping batch details update.")
+        return None
 
     pn = extracted["part_number"]
     if pn and len(pn) >= 7 and pn[4:7] == "682":
         extracted["product_description"] = "Foam Parts"
 
-    # Load Excel
-    df = pd.read_excel(excel_path, engine="openpyxl")
+    extracted["total_quantity"] = (
+        extracted["units_in_batch"] * extracted["quantity_per_unit"]
+        if extracted["units_in_batch"] > 0 and extracted["quantity_per_unit"] > 0
+        else ""
+    )
+
+    return extracted
+
+
+def apply_batch_updates(updates: list):
+    """
+    Applies extracted updates to batch details (see batch_store) in one load/save.
+    - Matches rows using batch_number
+    - Updates only empty cells
+    - Never deletes or overwrites existing data
+    """
+
+    updates = [u for u in updates if u]
+    if not updates:
+        return
+
+    df = load_batch_details()
 
     expected_columns = [
         "batch_number",
@@ -345,41 +435,59 @@ def update_excel_with_extraction(result: dict, excel_path: str = EXCEL_PATH):
         if col not in df.columns:
             df[col] = ""
 
-    match_idx = df.index[df["batch_number"] == extracted["batch_number"]].tolist()
-
-    if match_idx:
-        idx = match_idx[0]
-        row = df.loc[idx]
-
-        for col, value in extracted.items():
-            if (pd.isna(row[col]) or str(row[col]).strip() == "") and value not in ["", 0]:
-                df.at[idx, col] = value
-
-        if (
-            (pd.isna(row["total_quantity"]) or str(row["total_quantity"]).strip() == "")
-            and extracted["units_in_batch"] > 0
-            and extracted["quantity_per_unit"] > 0
-        ):
-            df.at[idx, "total_quantity"] = (
-                extracted["units_in_batch"] * extracted["quantity_per_unit"]
-            )
-
-    else:
-        total_qty = (
-            extracted["units_in_batch"] * extracted["quantity_per_unit"]
-            if extracted["units_in_batch"] > 0 and extracted["quantity_per_unit"] > 0
-            else ""
+    # First row per batch number is the one that gets updated
+    first_rows = df["batch_number"].drop_duplicates()
+    row_of = dict(zip(first_rows, first_rows.index))
+
+    existing = []
+    new_rows = []
+
+    for update in updates:
+        if update["batch_number"] in row_of:
+            existing.append(update)
+        else:
+            # Row label it will get once new rows are appended below
+            row_of[update["batch_number"]] = len(df) + len(new_rows)
+            new_rows.append(update)
+
+    # Append all new batches with a single concat (one copy of df)
+    if new_rows:
+        df = pd.concat([df, pd.DataFrame(new_rows)], ignore_index=True)
+
+    if existing:
+        # Earliest non-empty extracted value per batch and column
+        fills = (
+            pd.DataFrame(existing)
+            .replace({"": pd.NA, 0: pd.NA})
+            .groupby("batch_number", sort=False)
+            .first()
         )
+        targets = np.array([row_of[b] for b in fills.index])
+
+        for col in fills.columns:
+            current = df.loc[targets, col]
+            empty = (current.isna() | (current.astype(str).str.strip() == "")).to_numpy()
+            values = fills[col].to_numpy()
+            fill = empty & pd.notna(values)
 
-        new_row = {
-            **extracted,
-            "total_quantity": total_qty,
-        }
+            # Typed values, so e.g. ints can fill a float column with blanks
+            new = pd.Series(values[fill], index=targets[fill]).infer_objects()
+            # Values the column's dtype can't hold (text in a numeric or date
+            # column) widen it to object instead of raising
+            if df[col].dtype != object and not (
+                pd.api.types.is_numeric_dtype(df[col])
+                and pd.api.types.is_numeric_dtype(new)
+            ):
+                df[col] = df[col].astype(object)
+            df.loc[targets[fill], col] = new
 
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
+    save_batch_details(df)
+    print(f"Batch details updated for {len(updates)} extraction(s).")
 
-    df.to_excel(excel_path, index=False, engine="openpyxl")
-    print(f"Excel updated for batch: {extracted['batch_number']}")
+
+def update_batch_details_with_extraction(result: dict):
+    """Updates batch details using a single Gemini output."""
+    apply_batch_updates([extract_batch_update(result)])
 
 
 # ---------------------------------------------------------
@@ -388,17 +496,21 @@ def update_excel_with_extraction(result: dict, excel_path: str = EXCEL_PATH):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) == 2:
-        image_path = sys.argv[1]
+    image_paths = sys.argv[1:]
+
+    if image_paths:
+        print(f"\n=== Processing {len(image_paths)} image(s) ===")
 
-        print(f"\n=== Processing image from watchdog ===")
-        print(image_path)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results = list(executor.map(process_image_with_gemini, image_paths))
 
-        result = process_image_with_gemini(image_path)
-        print(json.dumps(result, indent=2))
+        for image_path, result in zip(image_paths, results):
+            print(image_path)
+            print(json.dumps(result, indent=2))
 
-        # update_csv_with_extraction(result)
-        update_excel_with_extraction(result)
+        # One load/save of batch details for the whole run
+        apply_batch_updates([extract_batch_update(r) for r in results])
+        export_batch_xlsx()
     
     # paths = [
     #     # r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DISCO\Database\label_images\eftec_label.jpg",
@@ -1,12 +1,22 @@
 import sys
 import time
-import subprocess
 import shutil
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from contextlib import contextmanager
 
+# Label extraction runs in-process: the LLM client and pandas are imported once
+ACOS_DIR = r"C:\Coding\ACOS"
+sys.path.insert(0, ACOS_DIR)
+
+from expiry_vision_01 import (
+    process_image_with_gemini,
+    update_batch_details_with_extraction,
+)
+
 # ---------------------------------------------------------
 # CONFIG
 # ---------------------------------------------------------
@@ -18,14 +28,17 @@ WATCH_FOLDER = Path(
 PROCESSED_FOLDER = WATCH_FOLDER / "Processed"
 RETRY_FOLDER = WATCH_FOLDER / "Retry"
 
-PYTHON_EXE = sys.executable
-EXPIRY_VISION_SCRIPT = r"C:\Coding\ACOS\expiry_vision_01.py"
-
 SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".png"}
 
 MAX_RETRIES = 3
 LOCK_SUFFIX = ".lock"
 
+# Quiet period after the last create/modify event before a file is processed
+DEBOUNCE_SECONDS = 0.5
+
+# Labels processed concurrently (Gemini calls overlap; batch updates are serialized)
+MAX_WORKERS = 4
+
 # ---------------------------------------------------------
 # SAFETY
 # ---------------------------------------------------------
@@ -37,18 +50,6 @@ def is_image_file(path: Path) -> bool:
     return path.suffix.lower() in SUPPORTED_EXTENSIONS
 
 
-def wait_until_file_stable(path: Path, timeout=10):
-    """Wait until file size stops changing (SharePoint sync safety)"""
-    last_size = -1
-    for _ in range(timeout):
-        current_size = path.stat().st_size
-        if current_size == last_size:
-            return True
-        last_size = current_size
-        time.sleep(1)
-    return False
-
-
 def get_retry_count(path: Path) -> int:
     """Extract retry count from filename: image__retry2.jpg"""
     if "__retry" in path.stem:
@@ -65,6 +66,14 @@ def increment_retry(path: Path) -> Path:
     return path.with_name(f"{base}__retry{count}{path.suffix}")
 
 
+def move_file(src: Path, dst: Path):
+    """Rename in place (one syscall, overwrites dst); copy+delete only across volumes."""
+    try:
+        src.replace(dst)
+    except OSError:
+        shutil.move(str(src), dst)
+
+
 @contextmanager
 def file_lock(path: Path):
     """Simple lock using a .lock file"""
@@ -87,7 +96,21 @@ def file_lock(path: Path):
 
 class LabelHandler(FileSystemEventHandler):
 
+    def __init__(self):
+        super().__init__()
+        self._pending = {}  # path -> debounce timer
+        self._pending_lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
     def on_created(self, event):
+        self._schedule(event)
+
+    def on_modified(self, event):
+        self._schedule(event)
+
+    def _schedule(self, event):
+        """(Re)start the debounce timer: SharePoint sync writes a file in several chunks."""
         if event.is_directory:
             return
 
@@ -101,10 +124,36 @@ class LabelHandler(FileSystemEventHandler):
         if not is_image_file(path):
             return
 
-        print(f"🆕 New label detected: {path.name}")
+        with self._pending_lock:
+            timer = self._pending.pop(path, None)
+            if timer:
+                timer.cancel()
+            else:
+                print(f"🆕 New label detected: {path.name}")
 
-        if not wait_until_file_stable(path):
-            print(f"⚠ File not stable, skipping: {path.name}")
+            timer = threading.Timer(
+                DEBOUNCE_SECONDS, self.executor.submit, args=(self._handle, path)
+            )
+            self._pending[path] = timer
+            timer.start()
+
+    def cancel_pending(self):
+        """Drop debounced events that haven't fired yet (called at shutdown)."""
+        with self._pending_lock:
+            timers = list(self._pending.values())
+            self._pending.clear()
+            for timer in timers:
+                timer.cancel()
+
+        # A timer that fired just before cancel() is still submitting; let it finish
+        for timer in timers:
+            timer.join()
+
+    def _handle(self, path: Path):
+        with self._pending_lock:
+            self._pending.pop(path, None)
+
+        if not path.exists():
             return
 
         try:
@@ -118,28 +167,31 @@ class LabelHandler(FileSystemEventHandler):
             print(f"❌ Unexpected error: {e}")
 
     def process_file(self, path: Path):
-        print("▶ Running expiry_vision_01.py")
+        print(f"▶ Extracting label: {path.name}")
 
-        result = subprocess.run(
-            [PYTHON_EXE, EXPIRY_VISION_SCRIPT, str(path)],
-            capture_output=True,
-            text=True
-        )
+        try:
+            result = process_image_with_gemini(str(path))
+            # Batch details are a single read-modify-write file
+            with self._update_lock:
+                update_batch_details_with_extraction(result)
+            error = result.get("error")
+        except Exception as e:
+            error = str(e)
 
-        if result.returncode == 0:
+        if not error:
             destination = PROCESSED_FOLDER / path.name
-            shutil.move(str(path), destination)
+            move_file(path, destination)
             print(f"✅ Processed and moved to: {destination}")
             return
 
         # ---- Retry handling ----
         retry_count = get_retry_count(path)
         print(f"❌ Processing failed (attempt {retry_count + 1})")
-        print(result.stderr)
+        print(error)
 
         if retry_count < MAX_RETRIES:
             new_path = RETRY_FOLDER / increment_retry(path).name
-            shutil.move(str(path), new_path)
+            move_file(path, new_path)
             print(f"🔁 Moved to retry folder: {new_path}")
         else:
             print(
@@ -167,6 +219,9 @@ def main():
         observer.stop()
 
     observer.join()
+    # No timer may call executor.submit after shutdown
+    handler.cancel_pending()
+    handler.executor.shutdown(wait=True)
 
 # ---------------------------------------------------------
 
@@ -1,20 +1,37 @@
+import os
 import pandas as pd
+import numpy as np
 import re
+from collections import defaultdict
+from pathlib import Path
 from rapidfuzz import process, fuzz
+from batch_store import load_batch_details, save_batch_details, read_excel_fast
 
 # ---------------------------------------------------------
 # PATHS
 # ---------------------------------------------------------
 
-BATCH_XLSX = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Data\batch_details.xlsx"
 VENDOR_MASTER_XLSX = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Data\vendor_master.xlsx"
 
+# Vendor master with normalized names, rebuilt when the workbook or this script changes
+VENDOR_MASTER_NORMALIZED = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Data\vendor_master.normalized.parquet"
+
+# ---------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------
+
+# Threads for RapidFuzz's scoring pool (one per CPU)
+MATCH_WORKERS = os.cpu_count() or 1
+
+# Score thresholds (token_sort_ratio, 0-100)
+MATCH_THRESHOLD = 85
+REVIEW_THRESHOLD = 70
+
 # ---------------------------------------------------------
 # LOAD DATA
 # ---------------------------------------------------------
 
-batch_df = pd.read_excel(BATCH_XLSX, engine = "openpyxl")
-vendor_master_df = pd.read_excel(VENDOR_MASTER_XLSX, engine = "openpyxl")
+batch_df = load_batch_details()
 
 # ---------------------------------------------------------
 # ENSURE REQUIRED COLUMNS
@@ -29,6 +46,22 @@ for col in [
     if col not in batch_df.columns:
         batch_df[col] = ""
 
+# Compact dtypes: scores are 0-100, statuses come from a fixed set.
+# Both survive the Parquet round trip (batch_store only stringifies object columns).
+MATCH_STATUSES = ["MATCHED", "REVIEW", "UNMATCHED", ""]
+
+batch_df["vendor_match_score"] = (
+    pd.to_numeric(batch_df["vendor_match_score"], errors="coerce")
+    .fillna(0)
+    .astype(np.uint8)
+)
+# Any other stored status (e.g. entered by hand) is kept as an extra category
+stored_status = batch_df["vendor_match_status"].astype(object).fillna("")
+batch_df["vendor_match_status"] = pd.Categorical(
+    stored_status,
+    categories=MATCH_STATUSES + sorted(set(stored_status) - set(MATCH_STATUSES), key=str)
+)
+
 # Safety: enforce uniqueness
 if "batch_number" in batch_df.columns:
     batch_df = batch_df.drop_duplicates(subset=["batch_number"], keep="first")
@@ -44,56 +77,62 @@ LEGAL_SUFFIXES = [
     "india", "international"
 ]
 
+# Compiled once; longest suffix first so "pvt ltd" wins over "pvt"
+SUFFIX_RE = re.compile(
+    r"\b(?:"
+    + "|".join(map(re.escape, sorted(LEGAL_SUFFIXES, key=len, reverse=True)))
+    + r")\b"
+)
+PUNCT_RE = re.compile(r"[^\w\s]")
+WHITESPACE_RE = re.compile(r"\s+")
+
 def normalize_vendor_name(name: str) -> str:
     if not isinstance(name, str):
         return ""
 
     name = name.lower().strip()
     name = name.replace("&", "and")
-    name = re.sub(r"[^\w\s]", " ", name)
-
-    for suffix in LEGAL_SUFFIXES:
-        name = re.sub(rf"\b{suffix}\b", "", name)
-
-    name = re.sub(r"\s+", " ", name).strip()
+    name = PUNCT_RE.sub(" ", name)
+    name = SUFFIX_RE.sub("", name)
+    name = WHITESPACE_RE.sub(" ", name).strip()
     return name
 
-vendor_master_df["normalized_name"] = vendor_master_df[
-    "vendor_canonical_name"
-].apply(normalize_vendor_name)
-
-batch_df["normalized_vendor"] = batch_df[
-    "vendor_or_brand"
-].apply(normalize_vendor_name)
-
-# ---------------------------------------------------------
-# MATCHING FUNCTION
-# ---------------------------------------------------------
-
-def match_vendor(normalized_name, vendor_master_df):
-    if not normalized_name:
-        return "", "", 0, "UNMATCHED"
-
-    choices = vendor_master_df["normalized_name"].tolist()
+def normalize_vendor_series(names: pd.Series) -> pd.Series:
+    """normalize_vendor_name for a whole column, using pandas' vectorized string methods."""
+    return (
+        names.astype(object)  # non-string cells become NaN below, then ""
+        .str.lower()
+        .str.strip()
+        .str.replace("&", "and", regex=False)
+        .str.replace(PUNCT_RE, " ", regex=True)
+        .str.replace(SUFFIX_RE, "", regex=True)
+        .str.replace(WHITESPACE_RE, " ", regex=True)
+        .str.strip()
+        .fillna("")
+    )
 
-    result = process.extractOne(
-        normalized_name,
-        choices,
-        scorer=fuzz.token_sort_ratio
+def load_vendor_master() -> pd.DataFrame:
+    """
+    Vendor names, emails and normalized names.
+    Read from the Parquet sidecar while it is newer than both the workbook
+    and this script (which holds the normalization rules); rebuilt otherwise.
+    """
+    sidecar = Path(VENDOR_MASTER_NORMALIZED)
+    source_mtime = max(
+        Path(VENDOR_MASTER_XLSX).stat().st_mtime_ns,
+        Path(__file__).stat().st_mtime_ns,
     )
 
-    if not result:
-        return "", "", 0, "UNMATCHED"
+    if sidecar.exists() and sidecar.stat().st_mtime_ns >= source_mtime:
+        return pd.read_parquet(sidecar, engine="pyarrow")
 
-    match, score, idx = result
-    row = vendor_master_df.iloc[idx]
+    master_cols = ["vendor_canonical_name", "vendor_email"]
+    df = read_excel_fast(VENDOR_MASTER_XLSX, text_columns=master_cols).reindex(columns=master_cols)
+    df["normalized_name"] = normalize_vendor_series(df["vendor_canonical_name"])
+    df.to_parquet(sidecar, engine="pyarrow", index=False)
+    return df
 
-    if score >= 85:
-        return row["vendor_canonical_name"], row["vendor_email"], score, "MATCHED"
-    elif score >= 70:
-        return row["vendor_canonical_name"], row["vendor_email"], score, "REVIEW"
-    else:
-        return "", "", score, "UNMATCHED"
+vendor_master_df = load_vendor_master()
 
 # ---------------------------------------------------------
 # APPLY MATCHING (ONLY WHERE EMPTY)
@@ -101,20 +140,110 @@ def match_vendor(normalized_name, vendor_master_df):
 
 mask = batch_df["vendor_canonical_name"].isna() | (batch_df["vendor_canonical_name"].astype(str).str.strip() == "")
 
-results = batch_df.loc[mask, "normalized_vendor"].apply(
-    lambda x: match_vendor(x, vendor_master_df)
+# Only rows still waiting for a vendor are normalized
+batch_df.loc[mask, "normalized_vendor"] = normalize_vendor_series(
+    batch_df.loc[mask, "vendor_or_brand"]
+)
+
+queries = batch_df.loc[mask, "normalized_vendor"].tolist()
+choices = vendor_master_df["normalized_name"].tolist()
+
+# Exact pre-pass: names that normalize to a master entry need no fuzzy scoring.
+# First occurrence wins, same as argmax over the score matrix.
+exact_map = {}
+for i, name in enumerate(choices):
+    if name:
+        exact_map.setdefault(name, i)
+
+exact_idx = np.array([exact_map.get(q, -1) for q in queries], dtype=np.intp)
+exact_hit = exact_idx >= 0
+
+best_idx = np.where(exact_hit, exact_idx, 0)
+# Exact (unrounded) scores: thresholds and argmax use the same values as
+# process.extractOne would
+best_score = np.where(exact_hit, 100.0, 0.0)
+
+def score_rows(rows, candidates):
+    """Best master index and score for queries[rows] among choices[candidates]."""
+    # One score matrix per call (C++ thread pool)
+    scores = process.cdist(
+        [queries[i] for i in rows],
+        [choices[j] for j in candidates],
+        scorer=fuzz.token_sort_ratio,
+        workers=MATCH_WORKERS,
+        dtype=np.float64,
+        # Pairs below the review threshold score 0 and can exit early
+        score_cutoff=REVIEW_THRESHOLD
+    )
+    local_idx = scores.argmax(axis=1)
+    best_idx[rows] = candidates[local_idx]
+    best_score[rows] = scores[np.arange(len(rows)), local_idx]
+
+# Blocking: a name is first scored only against master entries with the same
+# block key. token_sort_ratio compares sorted tokens, so the key is the
+# alphabetically first token, ignoring filler words ("&" is normalized to
+# "and", which would otherwise put every "X & Y" vendor in one block).
+BLOCK_STOPWORDS = {"and", "the", "of"}
+
+def block_key(name: str) -> str:
+    tokens = name.split()
+    return min((t for t in tokens if t not in BLOCK_STOPWORDS), default=min(tokens, default=""))
+
+blocks = defaultdict(list)
+for i, name in enumerate(choices):
+    blocks[block_key(name)].append(i)
+
+query_blocks = defaultdict(list)
+for i in np.flatnonzero(~exact_hit):
+    if queries[i]:
+        query_blocks[block_key(queries[i])].append(i)
+
+all_candidates = np.arange(len(choices), dtype=np.intp)
+rescore = []
+
+if len(choices):
+    # A block can miss the right vendor (typo in the key token, different
+    # first word). Anything short of a confident match in its block is
+    # re-scored against the whole master, so only MATCHED results rely on
+    # the block.
+    for key, rows in query_blocks.items():
+        if key in blocks:
+            score_rows(rows, np.asarray(blocks[key], dtype=np.intp))
+            rows = [i for i in rows if best_score[i] < MATCH_THRESHOLD]
+        rescore.extend(rows)
+
+    if rescore:
+        score_rows(rescore, all_candidates)
+
+# Empty vendor names are never matched
+best_score[np.array([not q for q in queries], dtype=bool)] = 0
+
+status = np.select(
+    [best_score >= MATCH_THRESHOLD, best_score >= REVIEW_THRESHOLD],
+    ["MATCHED", "REVIEW"],
+    default="UNMATCHED"
 )
+matched = status != "UNMATCHED"
+
+best_vendor = vendor_master_df.iloc[best_idx[matched]]
+names = np.full(len(queries), "", dtype=object)
+emails = np.full(len(queries), "", dtype=object)
+names[matched] = best_vendor["vendor_canonical_name"].to_numpy()
+emails[matched] = best_vendor["vendor_email"].to_numpy()
 
-batch_df.loc[mask, "vendor_canonical_name"] = results.apply(lambda x: x[0])
-batch_df.loc[mask, "vendor_email"] = results.apply(lambda x: x[1])
-batch_df.loc[mask, "vendor_match_score"] = results.apply(lambda x: x[2])
-batch_df.loc[mask, "vendor_match_status"] = results.apply(lambda x: x[3])
+batch_df.loc[mask, "vendor_canonical_name"] = names
+batch_df.loc[mask, "vendor_email"] = emails
+# Stored as whole numbers, rounded down so a stored score never reaches a
+# threshold its status didn't (84.85 is REVIEW and stored as 84)
+batch_df.loc[mask, "vendor_match_score"] = np.floor(best_score).astype(np.uint8)
+batch_df.loc[mask, "vendor_match_status"] = status
 
 # ---------------------------------------------------------
 # SAVE BACK
 # ---------------------------------------------------------
 
-batch_df.to_excel(BATCH_XLSX, index=False, engine = "openpyxl")
+save_batch_details(batch_df)
 
 print("Vendor matching completed")
-print(batch_df["vendor_match_status"].value_counts())
+# Categorical counts list every category; show only statuses that occur
+print(batch_df["vendor_match_status"].value_counts()[lambda counts: counts > 0])
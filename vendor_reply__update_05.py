@@ -3,18 +3,15 @@ import pandas as pd
 import re
 from datetime import datetime
 from pathlib import Path
-import time
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
+from batch_store import load_batch_details, save_batch_details, to_dates
 
 # ---------------------------------------------------------
-# CONFIG
+# UTILITIES
 # ---------------------------------------------------------
 
-BATCH_XLSX_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_ExpiryVision - Documents\Data\batch_details.xlsx"
+NEWLINES_RE = re.compile(r"\n+")
 
-# ---------------------------------------------------------
-# UTILITIES
-# ---------------------------------------------------------
 
 def clean_email_body(raw_body: str) -> str:
     """
@@ -24,31 +21,44 @@ def clean_email_body(raw_body: str) -> str:
     if not raw_body:
         return ""
 
-    soup = BeautifulSoup(raw_body, "html.parser")
-    for tag in soup(["script", "style"]):
-        tag.decompose()
-    text = soup.get_text(separator="\n")
-    text = re.sub(r"\n+", "\n", text)
+    tree = LexborHTMLParser(raw_body)
+    for node in tree.css("script, style"):
+        node.decompose()
+    root = tree.body or tree.root
+    text = root.text(separator="\n") if root else ""
+    text = NEWLINES_RE.sub("\n", text)
     return text.strip()
 
 
+# Any of these marks the end of the vendor's own reply; one scan finds the earliest.
+# The "On ... wrote:" header is matched lazily within one line of up to 200 chars,
+# so a miss fails fast instead of backtracking across the rest of the body.
+SPLIT_RE = re.compile(
+    r"PLEASE REPLY BELOW THIS LINE ONLY|On .{0,200}? wrote:|Regards,",
+    re.IGNORECASE
+)
+
+
 def extract_vendor_reply(cleaned_text: str) -> str:
     """
     Extract only the vendor's reply part from the email.
     Cuts off everything after template / quoted section.
     """
-    split_patterns = [
-        "PLEASE REPLY BELOW THIS LINE ONLY",
-        "On .* wrote:",
-        "Regards,",
-    ]
-    for pattern in split_patterns:
-        match = re.search(pattern, cleaned_text, re.IGNORECASE)
-        if match:
-            cleaned_text = cleaned_text[:match.start()]
+    match = SPLIT_RE.search(cleaned_text)
+    if match:
+        cleaned_text = cleaned_text[:match.start()]
     return cleaned_text.strip()
 
 
+# Match Batch blocks with valid YYYY-MM-DD dates (compiled once)
+BATCH_RE = re.compile(
+    r"Batch\s*No\.?\s*:\s*(?P<batch>[^\s]+(?:\s*/\s*\S+)?)\s*"
+    r"To\s*revalidate\?\s*:\s*(?P<reval>YES|NO)\s*"
+    r"(?:Revised\s*Expiry\s*Date\s*:\s*(?P<date>\d{4}-\d{2}-\d{2}))?",
+    re.IGNORECASE
+)
+
+
 def parse_vendor_response(email_text: str):
     """
     Extract batch responses from cleaned email text.
@@ -60,52 +70,30 @@ def parse_vendor_response(email_text: str):
         }
     }
     """
-    # Match Batch blocks with valid YYYY-MM-DD dates
-    pattern = re.compile(
-        r"Batch\s*No\.?\s*:\s*(?P<batch>[^\s]+(?:\s*/\s*\S+)?)\s*"
-        r"To\s*revalidate\?\s*:\s*(?P<reval>YES|NO)\s*"
-        r"(?:Revised\s*Expiry\s*Date\s*:\s*(?P<date>\d{4}-\d{2}-\d{2}))?",
-        re.IGNORECASE
-    )
-
     responses = {}
 
-    for match in pattern.finditer(email_text):
-        batch = match.group("batch").strip()
-        reval = match.group("reval").upper()
+    for match in BATCH_RE.finditer(email_text):
         date = match.group("date")
 
-        # Skip template placeholders
-        if date == "YYYY-MM-DD":
-            date = None
-
         # Only take the first valid response per batch
-        if batch not in responses:
-            responses[batch] = {
-                "revalidate": reval,
-                "revised_expiry_date": date
-            }
+        responses.setdefault(match.group("batch").strip(), {
+            "revalidate": match.group("reval").upper(),
+            # Skip template placeholders
+            "revised_expiry_date": None if date == "YYYY-MM-DD" else date
+        })
 
     return responses
 
 
-def parse_date(date_str):
-    if not date_str or pd.isna(date_str):
-        return None
-    for fmt in ("%Y-%m-%d", "%d-%m-%Y", "%d-%m-%y"):
-        try:
-            return datetime.strptime(str(date_str).strip(), fmt).date()
-        except ValueError:
-            continue
-    return None
-
 # ---------------------------------------------------------
 # CORE UPDATE ENGINE
 # ---------------------------------------------------------
 
-def apply_vendor_reply(raw_email_body: str):
-    df = pd.read_excel(BATCH_XLSX_PATH, engine="openpyxl")
-
+def _apply_vendor_reply_df(df: pd.DataFrame, raw_email_body: str) -> int:
+    """
+    Apply one vendor reply email to an already loaded batch table (in place).
+    No file I/O. Returns the number of batches updated.
+    """
     # Extract only vendor reply portion
     email_text = clean_email_body(raw_email_body)
     vendor_reply_text = extract_vendor_reply(email_text)
@@ -115,53 +103,77 @@ def apply_vendor_reply(raw_email_body: str):
 
     today_str = datetime.today().strftime("%Y-%m-%d")
     now_ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    updated_batches = 0
 
-    for idx, row in df.iterrows():
-        batch_no_excel = str(row.get("batch_number")).strip()
+    responses = pd.DataFrame.from_dict(
+        batch_responses_clean,
+        orient="index",
+        columns=["revalidate", "revised_expiry_date"]
+    )
 
-        if batch_no_excel not in batch_responses_clean:
-            continue
+    # Join replies onto batch rows by batch number (one hash lookup pass)
+    batch_keys = df["batch_number"].astype(str).str.strip()
+    hit = batch_keys.isin(responses.index)
+    matched = responses.reindex(batch_keys[hit]).set_axis(df.index[hit])
 
-        response = batch_responses_clean[batch_no_excel]
-        reval_flag = response["revalidate"]
-        revised_date = response["revised_expiry_date"]
+    # Dates parsed once per column, not per row
+    original_expiry = to_dates(df.loc[hit, "expiry_date"])
+    revised_expiry = pd.to_datetime(
+        matched["revised_expiry_date"], errors="coerce", format="%Y-%m-%d"
+    )
+    use_revised = (matched["revalidate"] == "YES") & revised_expiry.notna()
+    effective_expiry = revised_expiry.where(use_revised, original_expiry)
 
-        df.at[idx, "revalidation_status"] = reval_flag
-        df.at[idx, "last_vendor_response_date"] = today_str
-        df.at[idx, "revalidation_timestamp"] = now_ts
+    # New expiry dates are stored as datetime values, not text. Only the rows
+    # this reply answers are written; other cells are left exactly as stored.
+    for col in ("revised_expiry_date", "effective_expiry_date"):
+        if col not in df.columns:
+            df[col] = pd.NaT
+        elif not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].astype(object)
 
-        original_expiry = parse_date(row.get("expiry_date"))
+    df.loc[hit, "revalidation_status"] = matched["revalidate"]
+    df.loc[hit, "last_vendor_response_date"] = today_str
+    df.loc[hit, "revalidation_timestamp"] = now_ts
+    df.loc[use_revised.index[use_revised], "revised_expiry_date"] = revised_expiry[use_revised]
+    df.loc[hit, "effective_expiry_date"] = effective_expiry
 
-        if reval_flag == "YES" and revised_date:
-            revised_expiry = parse_date(revised_date)
-            if revised_expiry:
-                df.at[idx, "revised_expiry_date"] = revised_expiry.strftime("%Y-%m-%d")
-                df.at[idx, "effective_expiry_date"] = revised_expiry.strftime("%Y-%m-%d")
-            else:
-                df.at[idx, "effective_expiry_date"] = original_expiry.strftime("%Y-%m-%d")
-        else:
-            df.at[idx, "effective_expiry_date"] = original_expiry.strftime("%Y-%m-%d")
+    return int(hit.sum())
 
-        updated_batches += 1
 
-    df.to_excel(BATCH_XLSX_PATH, index=False, engine="openpyxl")
+def apply_vendor_reply(raw_email_body: str):
+    """Load batch details, apply one vendor reply and save."""
+    df = load_batch_details()
+    updated_batches = _apply_vendor_reply_df(df, raw_email_body)
+    save_batch_details(df)
     print(f"Vendor reply processed. Batches updated: {updated_batches}")
 
 
-if __name__ == "__main__":
-    try:
-        email_file_path = sys.argv[1] if len(sys.argv) >= 2 else r"C:\Coding\ACOS\test.txt"
+def apply_vendor_reply_files(email_file_paths):
+    """Apply several saved reply emails with one load and one save."""
+    df = load_batch_details()
 
+    for email_file_path in email_file_paths:
         with open(email_file_path, "r", encoding="utf-8") as f:
             raw_email_body = f.read()
 
-        apply_vendor_reply(raw_email_body)
-        time.sleep(5)
+        updated_batches = _apply_vendor_reply_df(df, raw_email_body)
+        print(f"{Path(email_file_path).name}: batches updated: {updated_batches}")
+
+    save_batch_details(df, export_xlsx=True)
+    print(f"Vendor replies processed: {len(email_file_paths)}")
+
+
+if __name__ == "__main__":
+    try:
+        email_file_paths = sys.argv[1:] or [r"C:\Coding\ACOS\test.txt"]
+
+        apply_vendor_reply_files(email_file_paths)
 
-    except Exception as e:
+    except Exception:
         import traceback
         print("ERROR:")
-        time.sleep(5)
         traceback.print_exc()
-        input("Press Enter to exit...")
+        # Keep the console open only when someone is there to read it
+        if sys.stdin.isatty():
+            input("Press Enter to exit...")
+        sys.exit(1)